@@ -6,40 +6,257 @@ Optimized for performance with batching and progress tracking.
 
 import os
 import csv
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import random
 import re
+import sqlite3
+import sys
+import threading
 import time
-from typing import List, Dict, Tuple, Optional
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from typing import Iterator, List, Dict, Tuple, Optional
 from datetime import datetime
+import httpx
+import orjson
 from notion_client import Client
 from notion_client.errors import APIResponseError, HTTPResponseError
-from langdetect import detect, LangDetectException
+import pycld2
 
 # Configuration
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 ROOT_PAGE_ID = os.getenv("ROOT_PAGE_ID")
 PROGRESS_INTERVAL = 5  # Report progress every N pages
+OUTPUT_FILE = "notion_language_percentages.csv"
+REPORT_FIELDS = ["Page Title", "Page URL", "% Russian", "% English"]
+MIN_DETECT_CHARS = 20  # Shorter texts are classified by alphabet, not by CLD2
+MIN_DETECT_WORDS = 3
+MAX_DETECT_CHARS = 100_000  # Text beyond this adds nothing to detection but cost
+BILINGUAL_THRESHOLD = 0.2  # Runner-up language share that marks a page as mixed
+MIXED_SCRIPT_SHARE = 0.05  # Minority alphabet share of letters that marks a page as mixed
+MIN_BLOCK_DETECT_WORDS = 20  # On mixed pages, shorter blocks are classified by alphabet
+DETECT_CACHE_MAX_CHARS = 4096  # Longer block texts rarely repeat, so their results are not cached
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING")  # Diagnostics below this level are dropped
+PAGE_BLOCK_TYPES = frozenset({"child_page", "child_database"})
+REQUESTS_PER_SECOND = float(os.getenv("NOTION_RPS", "2.7"))  # Just under Notion's 3 req/s average limit
+BLOCK_FETCH_WORKERS = 5  # Sibling blocks whose children are listed concurrently
+DETECT_WORKERS = os.cpu_count() or 1  # Processes running language detection
+NOTION_CACHE_TTL = int(os.getenv("NOTION_CACHE_TTL", "0"))  # Seconds; 0 disables the cache
+NOTION_CACHE_PATH = os.getenv("NOTION_CACHE_PATH", "notion_cache.sqlite")
+NOTION_PAGE_CACHE = os.getenv("NOTION_PAGE_CACHE", "0") == "1"  # Reuse unchanged pages' text across runs
 
 if not NOTION_TOKEN:
     raise ValueError("NOTION_TOKEN environment variable is required")
 if not ROOT_PAGE_ID:
     raise ValueError("ROOT_PAGE_ID environment variable is required")
-
-notion = Client(auth=NOTION_TOKEN)
+if REQUESTS_PER_SECOND <= 0:
+    raise ValueError("NOTION_RPS environment variable must be positive")
+
+
+class OrjsonClient(Client):
+    """Notion client that decodes successful responses with orjson."""
+
+    def _parse_response(self, response: httpx.Response):
+        # The stock parser uses the stdlib json module and also formats every
+        # body into a debug log message, even when debug logging is off.
+        # _parse_response is a private hook of notion-client 2.2.1; re-check
+        # this override before upgrading, it may be renamed or bypassed.
+        if response.is_success:
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError:
+                # orjson rejects escaped lone surrogates, which Notion text
+                # can contain and the stdlib parser accepts
+                pass
+        return super()._parse_response(response)
+
+
+logger = logging.getLogger("notion_language_check")
+
+# A maximal \w run is always bounded by \b, so this matches like \b\w+\b
+WORD_RE = re.compile(r"\w+")
+HEX_ID_RE = re.compile(r"([0-9a-fA-F]{32})")
+CYRILLIC_RUN_RE = re.compile(r"[а-яА-ЯёЁ]+")
+LATIN_RUN_RE = re.compile(r"[a-zA-Z]+")
+# Control characters and non-characters that CLD2 rejects as invalid UTF-8,
+# e.g. ANSI escapes and vertical tabs in pasted terminal output
+CLD2_INVALID_RE = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f-\x9f\ud800-\udfff\ufffe\uffff]")
 
 # Caches
-BLOCK_CACHE = {}
 VISITED_PAGES = set()
 
+# Clients, pools and caches below are created by init_resources() from main().
+# Detection workers are spawned and re-import this module, so they must not
+# open connections or start pools of their own at import time.
+notion = None
+
+# Shared by all pages so the pool is not rebuilt for every page
+BLOCK_EXECUTOR = None
+
+# Detection is CPU-bound and holds the GIL, so it runs in separate processes
+DETECT_EXECUTOR = None
+
+# Persistent API response cache, shared across runs when NOTION_CACHE_TTL is set
+RESPONSE_CACHE = None
+RESPONSE_CACHE_LOCK = threading.Lock()
+
+# Page contents keyed by last_edited_time, so pages unchanged since the last
+# run are not listed again; only used from the main thread
+PAGE_CACHE = None
+
+
+def init_resources() -> None:
+    """Create the API client, worker pools and caches once per process."""
+    global notion, BLOCK_EXECUTOR, DETECT_EXECUTOR, RESPONSE_CACHE, PAGE_CACHE
+    if BLOCK_EXECUTOR is not None:
+        return
+
+    # One pooled HTTP/2 connection is shared by all worker threads instead of
+    # opening a TLS session per concurrent request
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=BLOCK_FETCH_WORKERS,
+            max_keepalive_connections=BLOCK_FETCH_WORKERS,
+        ),
+    )
+    notion = OrjsonClient(auth=NOTION_TOKEN, client=http_client)
+
+    BLOCK_EXECUTOR = ThreadPoolExecutor(max_workers=BLOCK_FETCH_WORKERS)
+    # Worker processes start on first use. By then BLOCK_EXECUTOR threads may
+    # hold the HTTP pool and sqlite locks, so workers are spawned, not forked.
+    DETECT_EXECUTOR = ProcessPoolExecutor(
+        max_workers=DETECT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+    if NOTION_CACHE_TTL > 0:
+        RESPONSE_CACHE = sqlite3.connect(NOTION_CACHE_PATH, check_same_thread=False)
+        RESPONSE_CACHE.execute("CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v BLOB, ts INTEGER)")
+    if NOTION_PAGE_CACHE:
+        PAGE_CACHE = sqlite3.connect(NOTION_CACHE_PATH)
+        PAGE_CACHE.execute("CREATE TABLE IF NOT EXISTS pages (id TEXT PRIMARY KEY, last_edited TEXT, contents TEXT)")
+
+
+class TokenBucket:
+    """Thread-safe token bucket that only blocks once the burst budget is spent."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens: float = 1) -> None:
+        """Take tokens from the bucket, sleeping until enough have accumulated."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def refill(self) -> None:
+        """Restart from one second's worth of tokens, e.g. after a Retry-After wait."""
+        with self.lock:
+            self.tokens = min(self.capacity, self.rate)
+            self.updated = time.monotonic()
+
+
+# At least one whole token, or a bucket below 1 req/s could never serve a request
+RATE_LIMITER = TokenBucket(rate=REQUESTS_PER_SECOND, capacity=max(1.0, REQUESTS_PER_SECOND))
+
+
+def cache_key(func, args: tuple, kwargs: dict) -> str:
+    """Build a stable response cache key from an API call and its arguments."""
+    raw = repr((func.__qualname__, args, sorted(kwargs.items())))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def dump_json(value) -> bytes:
+    """Serialize a cache entry, falling back to json for text orjson refuses."""
+    try:
+        return orjson.dumps(value)
+    except TypeError:
+        # Lone surrogates are escaped by json but rejected by orjson
+        return json.dumps(value).encode("utf-8")
+
+
+def load_json(raw: bytes):
+    """Deserialize a cache entry written by dump_json."""
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw)
+
+
+def cache_get(key: str) -> Optional[dict]:
+    """Return a cached API response if it is younger than NOTION_CACHE_TTL."""
+    with RESPONSE_CACHE_LOCK:
+        row = RESPONSE_CACHE.execute("SELECT v, ts FROM kv WHERE k = ?", (key,)).fetchone()
+    if row and time.time() - row[1] < NOTION_CACHE_TTL:
+        return load_json(row[0])
+    return None
+
+
+def cache_put(key: str, value: dict) -> None:
+    """Store an API response in the persistent cache."""
+    with RESPONSE_CACHE_LOCK:
+        RESPONSE_CACHE.execute(
+            "INSERT OR REPLACE INTO kv (k, v, ts) VALUES (?, ?, ?)",
+            (key, dump_json(value), int(time.time()))
+        )
+        RESPONSE_CACHE.commit()
+
+
+def page_cache_get(page_id: str, last_edited: Optional[str]) -> Optional[dict]:
+    """Return a page's cached contents if it has not been edited since they were stored."""
+    if PAGE_CACHE is None or not last_edited:
+        return None
+    row = PAGE_CACHE.execute(
+        "SELECT contents FROM pages WHERE id = ? AND last_edited = ?", (page_id, last_edited)
+    ).fetchone()
+    return load_json(row[0]) if row else None
+
+
+def page_cache_put(entries: List[Tuple[str, str, dict]]) -> None:
+    """Store (page_id, last_edited, contents) entries in the page cache."""
+    if PAGE_CACHE is None:
+        return
+    PAGE_CACHE.executemany(
+        "INSERT OR REPLACE INTO pages (id, last_edited, contents) VALUES (?, ?, ?)",
+        [(page_id, last_edited, dump_json(contents)) for page_id, last_edited, contents in entries]
+    )
+    PAGE_CACHE.commit()
+
 
 def safe_request(func, *args, **kwargs):
     """Execute Notion API request with exponential backoff retry logic."""
     max_retries = 5
     base_delay = 1
 
+    key = None
+    if RESPONSE_CACHE is not None:
+        key = cache_key(func, args, kwargs)
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
+
     for attempt in range(max_retries):
         try:
+            RATE_LIMITER.consume()
             result = func(*args, **kwargs)
-            time.sleep(0.1)  # Rate limiting buffer
+            if key:
+                cache_put(key, result)
             return result
 
         except APIResponseError as e:
@@ -48,24 +265,26 @@ def safe_request(func, *args, **kwargs):
 
             if status == 429 or code == "rate_limited":
                 retry_after = getattr(e, "headers", {}).get("Retry-After")
-                wait_time = int(retry_after) if retry_after else (attempt + 1) * 2
-                print(f"⏸ Rate limited. Waiting {wait_time}s...")
+                # Jitter keeps workers limited together from retrying in lockstep
+                wait_time = (int(retry_after) if retry_after else (attempt + 1) * 2) + random.random()
+                logger.warning("⏸ Rate limited. Waiting %.1fs...", wait_time)
                 time.sleep(wait_time)
+                RATE_LIMITER.refill()
                 continue
 
             if status and 500 <= status <= 599:
-                wait_time = min(base_delay * (2 ** attempt), 8)
-                print(f"⚠ Server error ({status}). Retry {attempt + 1}/{max_retries}...")
+                wait_time = min(base_delay * (2 ** attempt), 8) + random.random()
+                logger.warning("⚠ Server error (%s). Retry %d/%d...", status, attempt + 1, max_retries)
                 time.sleep(wait_time)
                 continue
 
             # For other errors, fail fast
-            print(f"❌ API Error: {e}")
+            logger.error("❌ API Error: %s", e)
             raise
 
         except HTTPResponseError as e:
-            wait_time = min(base_delay * (2 ** attempt), 8)
-            print(f"⚠ HTTP error. Retry {attempt + 1}/{max_retries}...")
+            wait_time = min(base_delay * (2 ** attempt), 8) + random.random()
+            logger.warning("⚠ HTTP error. Retry %d/%d...", attempt + 1, max_retries)
             time.sleep(wait_time)
 
     raise RuntimeError("Notion API failed after maximum retries")
@@ -77,8 +296,14 @@ def normalize_id(raw_id: str) -> str:
         return raw_id
     
     cleaned = raw_id.strip().replace("-", "")
-    match = re.search(r"([0-9a-fA-F]{32})", cleaned)
-    return match.group(1) if match else cleaned
+    # API IDs are hyphenated UUIDs, so only other input needs the regex
+    if len(cleaned) != 32:
+        match = HEX_ID_RE.search(cleaned)
+        if match:
+            cleaned = match.group(1)
+    # Each ID is kept in several sets and dicts during the walk; interning
+    # stores it once and lets lookups match on identity
+    return sys.intern(cleaned)
 
 
 def make_url(page_id: str) -> str:
@@ -123,57 +348,37 @@ def get_children(block_id: str, page_size: int = 100) -> List[dict]:
 
 def query_database(db_id: str, cursor: Optional[str] = None) -> dict:
     """Query a Notion database with pagination support."""
-    params = {"database_id": db_id, "page_size": 100}
+    # Only the title is read from rows, so skip all other property values
+    params = {"database_id": db_id, "page_size": 100, "filter_properties": ["title"]}
     if cursor:
         params["start_cursor"] = cursor
     return safe_request(notion.databases.query, **params)
 
 
-def get_blocks_recursive(block_id: str, max_depth: int = 10, current_depth: int = 0) -> List[dict]:
-    """Recursively fetch nested blocks with caching and depth limit."""
-    if block_id in BLOCK_CACHE:
-        return BLOCK_CACHE[block_id]
-    
-    if current_depth >= max_depth:
-        return []
+def extract_rich_text(rich_text_list: List[dict]) -> str:
+    """Extract plain text from Notion rich text objects."""
+    # join() builds a list from a generator anyway, so a comprehension is faster
+    return " ".join([text for rt in rich_text_list if (text := rt.get("plain_text"))])
 
-    blocks = []
-    cursor = None
 
-    try:
-        while True:
-            response = safe_request(
-                notion.blocks.children.list,
-                block_id=block_id,
-                page_size=100,
-                start_cursor=cursor
-            )
-
-            for block in response.get("results", []):
-                blocks.append(block)
-                if block.get("has_children") and current_depth < max_depth - 1:
-                    blocks.extend(get_blocks_recursive(block["id"], max_depth, current_depth + 1))
-
-            if not response.get("has_more"):
-                break
-            cursor = response.get("next_cursor")
-    except Exception as e:
-        print(f"⚠ Error fetching blocks for {block_id}: {e}")
-        # Continue with what we have
-
-    BLOCK_CACHE[block_id] = blocks
-    return blocks
+def extract_table_row_text(data: dict) -> str:
+    """Extract text from all cells of a table row."""
+    # One flat join over every cell's pieces instead of a joined string per cell
+    return " ".join([
+        text for cell in data.get("cells", []) for rt in cell if (text := rt.get("plain_text"))
+    ])
 
 
-def extract_rich_text(rich_text_list: List[dict]) -> str:
-    """Extract plain text from Notion rich text objects."""
-    parts = []
-    for rt in rich_text_list:
-        if isinstance(rt, dict):
-            text = rt.get("plain_text", "")
-            if text:
-                parts.append(text)
-    return " ".join(parts)
+# Block type -> function pulling the block's own text out of its type data
+BLOCK_TEXT_EXTRACTORS = {
+    block_type: lambda data: extract_rich_text(data.get("rich_text", []))
+    for block_type in (
+        "paragraph", "heading_1", "heading_2", "heading_3",
+        "bulleted_list_item", "numbered_list_item", "to_do", "toggle",
+        "quote", "callout", "code", "template",
+    )
+}
+BLOCK_TEXT_EXTRACTORS["table_row"] = extract_table_row_text
 
 
 def extract_block_text(block: dict) -> str:
@@ -184,136 +389,349 @@ def extract_block_text(block: dict) -> str:
     
     data = block.get(block_type, {})
 
-    # Standard rich text blocks
-    if "rich_text" in data:
-        text = extract_rich_text(data["rich_text"])
+    extractor = BLOCK_TEXT_EXTRACTORS.get(block_type)
+    if extractor:
+        text = extractor(data)
         if text.strip():
             return text
 
-    # Captions (images, videos, etc.)
+    # Captions (images, videos, code, etc.)
     if "caption" in data:
         text = extract_rich_text(data["caption"])
         if text.strip():
             return text
 
-    # Table rows
-    if block_type == "table_row":
-        cell_texts = [extract_rich_text(cell) for cell in data.get("cells", [])]
-        combined = " ".join(cell_texts).strip()
-        if combined:
-            return combined
-
     return ""
 
 
-def collect_all_pages(root_id: str) -> List[str]:
-    """Recursively collect all page IDs in workspace."""
-    root_id = normalize_id(root_id)
-    
-    if root_id in VISITED_PAGES:
-        return []
-    
-    VISITED_PAGES.add(root_id)
+def list_container(block_id: str) -> Tuple[List[Dict[str, str]], List[str], List[Tuple[str, Optional[str]]], List[str]]:
+    """
+    List one block's children in a single pass.
+    Returns: (child pages, child database IDs, (block_id, content_id) pairs
+    of nested blocks to descend into, text of the listed blocks)
+    content_id is set for synced block copies: the original block they show.
+    """
     pages = []
-    
-    try:
-        children = get_children(root_id)
-    except Exception as e:
-        print(f"⚠ Error fetching children of {root_id}: {e}")
-        return pages
+    database_ids = []
+    next_ids = []
+    texts = []
 
-    for block in children:
+    for block in get_children(block_id):
         block_type = block.get("type")
 
         try:
             if block_type == "child_page":
-                page_id = normalize_id(block["id"])
-                pages.append(page_id)
-                pages.extend(collect_all_pages(page_id))
+                # The block already carries the title, no pages.retrieve needed
+                pages.append({
+                    "id": normalize_id(block["id"]),
+                    "title": block.get("child_page", {}).get("title") or "(Untitled)",
+                    "last_edited": block.get("last_edited_time"),
+                })
 
             elif block_type == "child_database":
-                db_id = block["id"]
-                cursor = None
-
-                while True:
-                    response = query_database(db_id, cursor)
-                    for row in response["results"]:
-                        page_id = row["id"]
-                        pages.append(page_id)
-                        pages.extend(collect_all_pages(page_id))
-
-                    cursor = response.get("next_cursor")
-                    if not cursor:
-                        break
-
-            elif block.get("has_children") and block_type not in ("child_page", "child_database"):
-                pages.extend(collect_all_pages(block["id"]))
-                
+                database_ids.append(normalize_id(block["id"]))
+
+            else:
+                text = extract_block_text(block)
+                if text.strip():
+                    texts.append(text)
+                if block.get("has_children"):
+                    synced_from = (block.get("synced_block") or {}).get("synced_from") or {}
+                    content_id = synced_from.get("block_id")
+                    next_ids.append((normalize_id(block["id"]), content_id and normalize_id(content_id)))
+
         except Exception as e:
-            print(f"⚠ Error processing block {block.get('id', 'unknown')}: {e}")
+            logger.warning("⚠ Error processing block %s: %s", block.get("id", "unknown"), e)
             continue
 
-    return pages
+    return pages, database_ids, next_ids, texts
 
 
-def detect_language(text: str) -> str:
-    """Detect language of text using langdetect."""
-    try:
-        return detect(text)
-    except (LangDetectException, Exception):
-        return "unknown"
+def list_database(db_id: str) -> Tuple[List[Dict[str, str]], List[str], List[str], List[str]]:
+    """List a database's rows as pages, in the same shape as list_container."""
+    pages = []
+    cursor = None
 
+    while True:
+        response = query_database(db_id, cursor)
+        for row in response["results"]:
+            pages.append({
+                "id": normalize_id(row["id"]),
+                "title": get_page_title(row),
+                "last_edited": row.get("last_edited_time"),
+            })
 
-def count_words(text: str) -> int:
-    """Count words in text."""
-    return len(re.findall(r"\b\w+\b", text))
+        cursor = response.get("next_cursor")
+        if not cursor:
+            break
+
+    return pages, [], [], []
 
 
-def analyze_page_language(page_id: str) -> Tuple[int, int, bool]:
+def list_page(page_id: str) -> Tuple[List[Dict[str, str]], List[str], List[str], List[str]]:
+    """Fetch a page's current title and edit time, in the same shape as list_container."""
+    page = get_page(page_id)
+    page_info = {
+        "id": normalize_id(page["id"]),
+        "title": get_page_title(page),
+        "last_edited": page.get("last_edited_time"),
+    }
+    return [page_info], [], [], []
+
+
+def collect_all_pages(root_id: str) -> Iterator[dict]:
     """
-    Analyze language distribution in a page.
-    Returns: (russian_words, english_words, has_no_readable_text)
+    Collect ID, title and block texts of all pages in workspace.
+    Pages are discovered and their text is read in the same walk, so every
+    block is listed once; each page gets the text of its own blocks only.
+    Pages are yielded as soon as all of their text is in, while the walk
+    goes on, so they can be analyzed before the rest of the tree is listed.
+    With NOTION_PAGE_CACHE, pages unchanged since the last run are served from
+    the page cache and only their subpages' edit times are fetched.
     """
-    russian_words = 0
-    english_words = 0
+    seen_pages = set()
+    # page id -> page whose own listings are still running
+    unfinished = {}
+    # page id -> number of its listings not yet processed
+    outstanding = Counter()
+    # Pages whose text is complete, waiting to be yielded
+    finished = []
+    texts_by_page = {}
+    children_by_page = {}
+    edited_by_page = {}
+    incomplete_pages = set()
+    # Pages showing synced block copies. Editing the original does not bump
+    # the copies' pages' last_edited_time, so these pages are never cached.
+    synced_copy_pages = set()
+    # (func, content_id) -> future, so nothing is fetched twice in a run
+    listings = {}
+    # future -> (block_id, owner_id) pairs waiting for its result
+    pending = {}
+
+    def schedule(func, block_id: str, owner_id: Optional[str] = None, content_id: Optional[str] = None) -> None:
+        # Skip containers reached through more than one path. Every copy of a
+        # synced block shows the original's children, so the copies share
+        # one listing, but each page that embeds one still gets the text.
+        key = (func, content_id or block_id)
+        if (key, owner_id) in VISITED_PAGES:
+            return
+        VISITED_PAGES.add((key, owner_id))
+        if key not in listings:
+            listings[key] = BLOCK_EXECUTOR.submit(func, block_id)
+        pending.setdefault(listings[key], []).append((block_id, owner_id))
+        outstanding[owner_id] += 1
+
+    def finish_if_done(page_id: str) -> None:
+        if page_id in unfinished and not outstanding[page_id]:
+            page = unfinished.pop(page_id)
+            page["texts"] = texts_by_page.get(page_id, [])
+            finished.append(page)
+
+    def add_page(page: dict) -> None:
+        page_id = page["id"]
+        if page_id in seen_pages:
+            return
+        seen_pages.add(page_id)
+        last_edited = page.pop("last_edited", None)
+        unfinished[page_id] = page
+
+        cached = page_cache_get(page_id, last_edited)
+        if cached is None:
+            edited_by_page[page_id] = last_edited
+            schedule(list_container, page_id, page_id)
+            finish_if_done(page_id)
+            return
+
+        # Unchanged page: its own text and children are known, but subpages
+        # and database rows may have been edited since, so look those up
+        texts_by_page[page_id] = cached["texts"]
+        for subpage_id in cached["pages"]:
+            schedule(list_page, subpage_id)
+        for db_id in cached["databases"]:
+            schedule(list_database, db_id)
+        finish_if_done(page_id)
 
+    root_id = normalize_id(root_id)
+    schedule(list_container, root_id, root_id)
+
+    # Each container is listed as soon as its parent is, rather than level by
+    # level, so one slow listing does not hold up the rest of the tree
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for block_id, owner_id in pending.pop(future):
+                outstanding[owner_id] -= 1
+                try:
+                    found_pages, database_ids, child_ids, texts = future.result()
+                except Exception as e:
+                    logger.warning("⚠ Error fetching children of %s: %s", block_id, e)
+                    incomplete_pages.add(owner_id)
+                    finish_if_done(owner_id)
+                    continue
+
+                if owner_id:
+                    texts_by_page.setdefault(owner_id, []).extend(texts)
+                    children = children_by_page.setdefault(owner_id, {"pages": [], "databases": []})
+                    children["pages"].extend(page["id"] for page in found_pages)
+                    children["databases"].extend(database_ids)
+
+                for page in found_pages:
+                    add_page(page)
+                for db_id in database_ids:
+                    schedule(list_database, db_id)
+                for child_id, content_id in child_ids:
+                    if content_id:
+                        synced_copy_pages.add(owner_id)
+                    schedule(list_container, child_id, owner_id, content_id)
+                finish_if_done(owner_id)
+
+        yield from finished
+        finished.clear()
+
+    page_cache_put([
+        (page_id, last_edited, {
+            "texts": texts_by_page.get(page_id, []),
+            **children_by_page.get(page_id, {"pages": [], "databases": []}),
+        })
+        for page_id, last_edited in edited_by_page.items()
+        if last_edited and page_id in children_by_page
+        and page_id not in incomplete_pages and page_id not in synced_copy_pages
+    ])
+
+
+def detect_language_uncached(text: str) -> str:
+    """Detect language of text using CLD2."""
     try:
-        blocks = get_blocks_recursive(page_id, max_depth=5)
+        is_reliable, _, details = pycld2.detect(
+            CLD2_INVALID_RE.sub(" ", text[:MAX_DETECT_CHARS]), bestEffort=True
+        )
+    except (pycld2.error, Exception):
+        return guess_language_by_charset(text)
+    return details[0][1] if is_reliable else "unknown"
 
-        for block in blocks:
-            text = extract_block_text(block)
-            if not text.strip():
-                continue
 
-            word_count = count_words(text)
-            if word_count == 0:
-                continue
+# Per worker process; template blocks repeat the same text across many pages
+detect_language_cached = functools.lru_cache(maxsize=8192)(detect_language_uncached)
+
+
+def detect_language(text: str) -> str:
+    """Detect language of text, reusing results for repeated short texts."""
+    if len(text) <= DETECT_CACHE_MAX_CHARS:
+        return detect_language_cached(text)
+    return detect_language_uncached(text)
+
+
+def detect_languages(text: str) -> List[Tuple[str, float]]:
+    """Detect candidate languages of text with their share of it, largest first."""
+    try:
+        is_reliable, _, details = pycld2.detect(CLD2_INVALID_RE.sub(" ", text), bestEffort=True)
+    except (pycld2.error, Exception):
+        return [(guess_language_by_charset(text), 1.0)]
+    if not is_reliable:
+        return []
+    return [(code, percent / 100) for _, code, percent, _ in details if code != "un"]
 
-            language = detect_language(text)
 
-            if language == "ru":
-                russian_words += word_count
-            elif language == "en":
-                english_words += word_count
-                
-    except Exception as e:
-        print(f"⚠ Error analyzing page {page_id}: {e}")
+def count_script_letters(text: str) -> Tuple[int, int]:
+    """Count Cyrillic and Latin letters in text."""
+    # Scanning whole letter runs keeps the per-character loop inside the regex engine
+    russian_chars = sum(map(len, CYRILLIC_RUN_RE.findall(text)))
+    english_chars = sum(map(len, LATIN_RUN_RE.findall(text)))
+    return russian_chars, english_chars
 
+
+def guess_language_by_charset(text: str) -> str:
+    """Guess language of short text by comparing Cyrillic and Latin letters."""
+    russian_chars, english_chars = count_script_letters(text)
+
+    if russian_chars > english_chars:
+        return "ru"
+    if english_chars > russian_chars:
+        return "en"
+    return "unknown"
+
+
+def count_words(text: str) -> int:
+    """Count words in text."""
+    return len(WORD_RE.findall(text))
+
+
+def analyze_texts(texts: List[str]) -> Tuple[int, int, bool]:
+    """
+    Analyze language distribution of a page's block texts.
+    Runs in a DETECT_EXECUTOR worker process, so it must not touch the API.
+    Returns: (russian_words, english_words, has_no_readable_text)
+    """
+    words_by_language = Counter()
+
+    # Repeated texts (labels, template headings, table cells) are counted
+    # and detected only once
+    occurrences = Counter(texts)
+    word_counts = {text: count_words(text) for text in occurrences}
+    page_words = sum(word_counts[text] * times for text, times in occurrences.items())
+
+    # One detection over the whole page instead of one per block; a
+    # bounded sample keeps huge pages (code dumps, logs) from stalling it
+    page_text = " ".join(occurrences)[:MAX_DETECT_CHARS]
+    if len(page_text) < MIN_DETECT_CHARS or page_words < MIN_DETECT_WORDS:
+        candidates = [(guess_language_by_charset(page_text), 1.0)]
+    else:
+        candidates = detect_languages(page_text)
+
+    # A small share of the other language can be folded into the
+    # dominant one by the detector, so the alphabet mix is checked too.
+    # Most pages use one alphabet only; a single search for the other one
+    # settles those without counting every letter.
+    minority_share = 0.0
+    if CYRILLIC_RUN_RE.search(page_text) and LATIN_RUN_RE.search(page_text):
+        russian_chars, english_chars = count_script_letters(page_text)
+        minority_share = min(russian_chars, english_chars) / (russian_chars + english_chars)
+    # Without a reliable page-level answer, fall back to classifying block by
+    # block, so one odd block does not leave the whole page unreadable
+    bilingual = (
+        not candidates
+        or (len(candidates) > 1 and candidates[1][1] > BILINGUAL_THRESHOLD)
+        or minority_share > MIXED_SCRIPT_SHARE
+    )
+    if not bilingual:
+        page_language = candidates[0][0]
+        words_by_language[page_language] += page_words
+    else:
+        # Mixed or undetected page: detect long blocks on their own, classify
+        # the rest by alphabet since detection is unreliable on short fragments
+        for text, times in occurrences.items():
+            word_count = word_counts[text]
+            if word_count >= MIN_BLOCK_DETECT_WORDS:
+                language = detect_language(text)
+            else:
+                language = guess_language_by_charset(text)
+            words_by_language[language] += word_count * times
+
+    russian_words = words_by_language["ru"]
+    english_words = words_by_language["en"]
     has_no_text = (russian_words + english_words) == 0
     return russian_words, english_words, has_no_text
 
 
-def save_progress(results: List[dict], filename: str = "notion_language_percentages.csv"):
-    """Save current results to CSV."""
-    with open(filename, "w", encoding="utf-8", newline="") as f:
-        fieldnames = ["Page Title", "Page URL", "% Russian", "% English"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+def sort_report(filename: str = OUTPUT_FILE):
+    """Sort the streamed report by English percentage, then Russian, in place."""
+    with open(filename, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    rows.sort(key=lambda row: (float(row["% English"]), float(row["% Russian"])), reverse=True)
+
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
         writer.writeheader()
-        writer.writerows(results)
+        writer.writerows(rows)
+    os.replace(tmp_filename, filename)
 
 
 def main():
     """Main execution function."""
+    logging.basicConfig(level=LOG_LEVEL, format="  %(levelname)s %(message)s")
+    init_resources()
     start_time = time.time()
     print("=" * 70)
     print("🔍 Notion Language Analysis")
@@ -323,68 +741,69 @@ def main():
 
     print("📥 Collecting pages from workspace...")
     root_normalized = normalize_id(ROOT_PAGE_ID)
-    page_ids = list(dict.fromkeys(collect_all_pages(root_normalized)))
-    print(f"✅ Found {len(page_ids)} pages to analyze\n")
+    # Each page goes to detection as soon as the walk has all of its text,
+    # so analysis runs on all cores while the rest of the tree is listed
+    futures = {
+        DETECT_EXECUTOR.submit(analyze_texts, page.pop("texts")): page
+        for page in collect_all_pages(root_normalized)
+    }
+    print(f"✅ Found {len(futures)} pages to analyze\n")
 
     print("🔬 Analyzing language distribution...")
-    results = []
     analyzed_count = 0
     skipped_count = 0
 
-    for idx, page_id in enumerate(page_ids, 1):
-        elapsed = time.time() - start_time
-        
-        # Progress reporting
-        if idx % PROGRESS_INTERVAL == 0 or idx == len(page_ids):
-            rate = idx / elapsed if elapsed > 0 else 0
-            eta = (len(page_ids) - idx) / rate if rate > 0 else 0
-            print(f"  📊 Progress: {idx}/{len(page_ids)} | "
-                  f"Rate: {rate:.1f} pages/s | "
-                  f"ETA: {eta/60:.1f}m | "
-                  f"Elapsed: {elapsed/60:.1f}m")
-
-        try:
-            # Fetch page title
-            page = safe_request(notion.pages.retrieve, page_id=page_id)
-            title = get_page_title(page)
-            url = make_url(page_id)
-
-            # Language analysis
-            russian_words, english_words, unreadable = analyze_page_language(page_id)
+    # Rows are streamed to the report as each page finishes, so a run that
+    # is cut short still leaves a usable (unsorted) CSV behind.
+    # Titles may carry lone surrogates, which UTF-8 cannot encode
+    with open(OUTPUT_FILE, "w", encoding="utf-8", errors="replace", newline="") as report:
+        writer = csv.DictWriter(report, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
 
-            if unreadable:
+        for idx, future in enumerate(as_completed(futures), 1):
+            elapsed = time.time() - start_time
+
+            # Progress reporting
+            if idx % PROGRESS_INTERVAL == 0 or idx == len(futures):
+                rate = idx / elapsed if elapsed > 0 else 0
+                eta = (len(futures) - idx) / rate if rate > 0 else 0
+                print(f"  📊 Progress: {idx}/{len(futures)} | "
+                      f"Rate: {rate:.1f} pages/s | "
+                      f"ETA: {eta/60:.1f}m | "
+                      f"Elapsed: {elapsed/60:.1f}m")
+
+            page = futures[future]
+            page_id = page["id"]
+            try:
+                # Language analysis
+                russian_words, english_words, unreadable = future.result()
+
+                if unreadable:
+                    logger.debug("Skipping page without readable text: %s", page_id)
+                    skipped_count += 1
+                    continue
+
+                total_words = russian_words + english_words
+                russian_pct = (russian_words * 100 / total_words) if total_words else 0
+                english_pct = (english_words * 100 / total_words) if total_words else 0
+
+                writer.writerow({
+                    "Page Title": page["title"],
+                    "Page URL": make_url(page_id),
+                    "% Russian": round(russian_pct, 2),
+                    "% English": round(english_pct, 2)
+                })
+                report.flush()
+
+                analyzed_count += 1
+
+            except Exception as e:
+                logger.warning("❌ Error processing page %s: %s", page_id, e)
                 skipped_count += 1
                 continue
 
-            total_words = russian_words + english_words
-            russian_pct = (russian_words * 100 / total_words) if total_words else 0
-            english_pct = (english_words * 100 / total_words) if total_words else 0
-
-            results.append({
-                "Page Title": title,
-                "Page URL": url,
-                "% Russian": round(russian_pct, 2),
-                "% English": round(english_pct, 2)
-            })
-            
-            analyzed_count += 1
-            
-            # Save progress periodically
-            if analyzed_count % 50 == 0:
-                save_progress(results)
-                print(f"  💾 Progress saved ({analyzed_count} pages)")
-                
-        except Exception as e:
-            print(f"  ❌ Error processing page {idx}: {e}")
-            skipped_count += 1
-            continue
-
     # Sort by English percentage (descending), then Russian
-    results.sort(key=lambda x: (x["% English"], x["% Russian"]), reverse=True)
-
-    # Final save
-    output_file = "notion_language_percentages.csv"
-    save_progress(results, output_file)
+    sort_report(OUTPUT_FILE)
 
     elapsed = time.time() - start_time
     
@@ -393,9 +812,9 @@ def main():
     print("=" * 70)
     print(f"✅ Successfully analyzed: {analyzed_count} pages")
     print(f"⏭️  Skipped (no content): {skipped_count} pages")
-    print(f"📄 Output file: {output_file}")
+    print(f"📄 Output file: {OUTPUT_FILE}")
     print(f"⏱️  Total duration: {elapsed/60:.1f} minutes ({elapsed:.1f}s)")
-    print(f"⚡ Average speed: {len(page_ids)/elapsed:.1f} pages/second")
+    print(f"⚡ Average speed: {len(futures)/elapsed:.1f} pages/second")
     print("=" * 70)
 
 
@@ -1,6 +1,8 @@
 from notion_client import Client
 from notion_client.errors import APIResponseError
+import functools
 import os
+import threading
 import time
 import requests
 from datetime import datetime, timezone, timedelta
@@ -18,26 +20,74 @@ if not ROOT_PAGE_ID:
     raise ValueError("ROOT_PAGE_ID is not set")
 
 notion = Client(auth=NOTION_TOKEN)
+ROOT_ID = ROOT_PAGE_ID.replace("-", "")
+
+# Parent types whose object can be retrieved to keep climbing to the root,
+# mapped to their endpoint; each type is also the retrieve call's argument
+PARENT_ENDPOINTS = {
+    "page_id": "pages",
+    "database_id": "databases",
+    "block_id": "blocks",
+}
 
 # Time range: 7 to 21 days ago
 SEVEN_DAYS_AGO = datetime.now(timezone.utc) - timedelta(days=7)
 TWENTY_ONE_DAYS_AGO = datetime.now(timezone.utc) - timedelta(days=21)
 
+# Just under Notion's 3 req/s average limit, overridable per run
+REQUESTS_PER_SECOND = float(os.getenv("NOTION_RPS", "2.7"))
+if REQUESTS_PER_SECOND <= 0:
+    raise ValueError("NOTION_RPS is not positive")
+
 # Timeout protection (5 hours max)
 MAX_EXECUTION_TIME = 5 * 60 * 60  # 5 hours in seconds
 START_TIME = time.time()
 
+# ------------------------
+# RATE LIMITING
+# ------------------------
+class TokenBucket:
+    """Lets bursts through and only sleeps once the request budget is spent."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens: float = 1) -> None:
+        """Take tokens from the bucket, sleeping until enough have accumulated."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def refill(self) -> None:
+        """Restart from one second's worth of tokens, e.g. after a Retry-After wait."""
+        with self.lock:
+            self.tokens = min(self.capacity, self.rate)
+            self.updated = time.monotonic()
+
+# At least one whole token, or a bucket below 1 req/s could never serve a request
+RATE_LIMITER = TokenBucket(rate=REQUESTS_PER_SECOND, capacity=max(1.0, REQUESTS_PER_SECOND))
+
 # ------------------------
 # SAFE REQUEST (retry)
 # ------------------------
 def safe_request(func, *args, **kwargs):
     max_retries = 8
-    delay = 0.25
     backoff = 1
 
     for attempt in range(max_retries):
         try:
-            time.sleep(delay)
+            RATE_LIMITER.consume()
             return func(*args, **kwargs)
         except APIResponseError as e:
             status = e.status
@@ -46,6 +96,7 @@ def safe_request(func, *args, **kwargs):
                 retry_after = int(getattr(e, "headers", {}).get("Retry-After", 1))
                 print(f"[429] Rate limit → wait {retry_after}s")
                 time.sleep(retry_after)
+                RATE_LIMITER.refill()
                 continue
 
             if 500 <= status <= 599:
@@ -72,11 +123,49 @@ def notion_url(page_id):
     clean = page_id.replace("-", "")
     return f"https://www.notion.so/{clean}"
 
-def get_page_info(page_id):
-    """Extracts title, url, author, created."""
+# user id -> name, filled once per run by load_user_names()
+USER_NAMES = {}
+
+def load_user_names():
+    """Preloads every workspace member's name with a paginated users.list."""
+    cursor = None
+
+    while True:
+        try:
+            resp = safe_request(
+                notion.users.list,
+                start_cursor=cursor,
+                page_size=100
+            )
+        except Exception as e:
+            # Missing user capability: fall back to per-user lookups
+            print(f"Could not list users: {e}")
+            return
+
+        for user in resp.get("results", []):
+            if user.get("name"):
+                USER_NAMES[user["id"]] = user["name"]
+
+        cursor = resp.get("next_cursor")
+        if not cursor:
+            break
+
+@functools.lru_cache(maxsize=None)
+def get_user_name(user_id):
+    """Returns a user's name, fetched once per user for the whole scan."""
+    if user_id in USER_NAMES:
+        return USER_NAMES[user_id]
+
+    # Guests and bots may be missing from users.list
+    try:
+        user = safe_request(notion.users.retrieve, user_id=user_id)
+    except Exception:
+        return None
+    return user.get("name")
+
+def get_page_info(page):
+    """Extracts title, url, author, created from a page object."""
     check_timeout()
-    
-    page = safe_request(notion.pages.retrieve, page_id=page_id)
 
     # Title
     title = "Untitled"
@@ -91,129 +180,133 @@ def get_page_info(page_id):
 
     # Fix missing name
     if author == created_by.get("id"):
-        try:
-            user = safe_request(notion.users.retrieve, user_id=created_by["id"])
-            author = user.get("name") or author
-        except:
-            pass
+        author = get_user_name(created_by["id"]) or author
 
     # Created time
     created_raw = page.get("created_time", "")
     created_dt = datetime.fromisoformat(created_raw.replace("Z", "+00:00")).astimezone(timezone.utc)
 
     return {
-        "id": page_id,
+        "id": page["id"],
         "title": title,
-        "url": notion_url(page_id),
+        "url": notion_url(page["id"]),
         "author": author,
         "created": created_dt
     }
 
 # ------------------------
-# BLOCK CHILDREN
+# ANCESTRY
 # ------------------------
-def get_block_children(block_id):
-    check_timeout()
-    
-    blocks = []
+# page id (without dashes) -> parent of every page already returned by search
+KNOWN_PARENTS = {}
+
+# (parent type, id without dashes) -> whether that object lies under the root
+ANCESTRY_CACHE = {}
+
+def get_parent(parent_type, parent_id):
+    """Returns the parent dict of a page, database or block."""
+    clean_id = parent_id.replace("-", "")
+    if parent_type == "page_id" and clean_id in KNOWN_PARENTS:
+        # Parent page was in the search results, no need to retrieve it
+        return KNOWN_PARENTS[clean_id]
+
+    retrieve = getattr(notion, PARENT_ENDPOINTS[parent_type]).retrieve
+    return safe_request(retrieve, **{parent_type: parent_id}).get("parent", {})
+
+def is_under_root(parent_type, parent_id):
+    """True if the given parent is ROOT_PAGE_ID or lies beneath it.
+    Climbs one hop at a time and records the answer for every hop, so
+    each object on the way up is looked at once for the whole scan."""
+    chain = []
+    result = False
+
+    while True:
+        if parent_type not in PARENT_ENDPOINTS:
+            # Workspace level: the chain ended without reaching the root
+            break
+
+        key = (parent_type, parent_id.replace("-", ""))
+        if key[1] == ROOT_ID:
+            result = True
+            break
+        if key in ANCESTRY_CACHE:
+            result = ANCESTRY_CACHE[key]
+            break
+        if key in chain:
+            break
+        chain.append(key)
+
+        try:
+            parent = get_parent(parent_type, parent_id)
+        except Exception as e:
+            print(f"Skip parent {parent_id}: {e}")
+            break
+
+        parent_type = parent.get("type")
+        parent_id = parent.get(parent_type, "")
+
+    for key in chain:
+        ANCESTRY_CACHE[key] = result
+    return result
+
+# ------------------------
+# RECENT PAGES
+# ------------------------
+def search_recent_pages(since):
+    """Yields every page edited since `since`, most recently edited first."""
     cursor = None
 
     while True:
+        check_timeout()
+
         resp = safe_request(
-            notion.blocks.children.list,
-            block_id=block_id,
-            start_cursor=cursor
+            notion.search,
+            filter={"property": "object", "value": "page"},
+            sort={"direction": "descending", "timestamp": "last_edited_time"},
+            start_cursor=cursor,
+            page_size=100
         )
 
-        blocks.extend(resp.get("results", []))
+        for page in resp.get("results", []):
+            edited_raw = page.get("last_edited_time", "")
+            edited = datetime.fromisoformat(edited_raw.replace("Z", "+00:00")).astimezone(timezone.utc)
+            # Sorted by edit time, so every remaining page is older too
+            if edited < since:
+                return
+            yield page
 
         cursor = resp.get("next_cursor")
         if not cursor:
             break
 
-        time.sleep(0.1)
-
-    return blocks
-
-# ------------------------
-# FULL SCAN WITH VISITED TRACKING
-# ------------------------
-def get_all_pages(block_id, visited=None, depth=0):
+def get_all_pages():
     """
-    Recursively scan pages with cycle detection.
-    visited: set of already-processed page/block IDs
-    depth: recursion depth (for debugging)
+    Returns info for every page under the root that may have been created
+    in the report window. A page is edited no earlier than it is created, so
+    only pages edited since TWENTY_ONE_DAYS_AGO need to be looked at; search
+    lists them without walking the block tree of the whole workspace.
     """
-    if visited is None:
-        visited = set()
-    
-    # Prevent cycles
-    if block_id in visited:
-        return []
-    
-    visited.add(block_id)
-    check_timeout()
-    
-    # Safety: limit recursion depth
-    if depth > 50:
-        print(f"Max depth (50) reached at block {block_id}")
-        return []
-    
     pages = []
-    
-    try:
-        children = get_block_children(block_id)
-    except Exception as e:
-        print(f"Failed to get children of {block_id}: {e}")
-        return []
 
-    for block in children:
-        check_timeout()
-        
-        btype = block["type"]
-        bid = block["id"]
+    # Index every result's parent first, so pages nested under other recent
+    # pages resolve their ancestry locally instead of through pages.retrieve
+    candidates = list(search_recent_pages(TWENTY_ONE_DAYS_AGO))
+    for page in candidates:
+        KNOWN_PARENTS[page["id"].replace("-", "")] = page.get("parent", {})
 
-        # Skip if already visited
-        if bid in visited:
+    for page in candidates:
+        if page["id"].replace("-", "") == ROOT_ID:
             continue
 
-        # 1️⃣ Child page
-        if btype == "child_page":
-            try:
-                info = get_page_info(bid)
-                pages.append(info)
-                # Recursively scan this page's children
-                pages.extend(get_all_pages(bid, visited, depth + 1))
-            except Exception as e:
-                print(f"Skip child_page {bid}: {e}")
-
-        # 2️⃣ Child database
-        elif btype == "child_database":
-            try:
-                db_pages = safe_request(notion.databases.query, database_id=bid)
-                for db_page in db_pages["results"]:
-                    pid = db_page["id"]
-                    
-                    if pid in visited:
-                        continue
-
-                    try:
-                        info = get_page_info(pid)
-                        pages.append(info)
-                        pages.extend(get_all_pages(pid, visited, depth + 1))
-                    except Exception as e:
-                        print(f"Skip db row {pid}: {e}")
-
-            except Exception as e:
-                print(f"Skip database {bid}: {e}")
-
-        # 3️⃣ Nested blocks (columns, toggles, etc.) - ONLY if not a page/database
-        elif btype not in ["child_page", "child_database"] and block.get("has_children", False):
-            try:
-                # Don't add to pages list, just recurse to find nested pages
-                pages.extend(get_all_pages(bid, visited, depth + 1))
-            except Exception as e:
-                print(f"Skip nested block {bid}: {e}")
+        parent = page.get("parent", {})
+        parent_type = parent.get("type")
+        if parent_type not in PARENT_ENDPOINTS or not is_under_root(parent_type, parent[parent_type]):
+            continue
+
+        try:
+            pages.append(get_page_info(page))
+        except Exception as e:
+            print(f"Skip page {page['id']}: {e}")
 
     return pages
 
@@ -233,9 +326,11 @@ def send_slack(text):
 # ------------------------
 def main():
     try:
-        print("Scanning Notion deeply…")
-        pages = get_all_pages(ROOT_PAGE_ID)
-        print(f"Total discovered pages: {len(pages)}")
+        load_user_names()
+
+        print("Searching Notion for recently edited pages…")
+        pages = get_all_pages()
+        print(f"Recently edited pages under root: {len(pages)}")
 
         # Filter pages created between 7 and 21 days ago
         filtered_pages = [
@@ -6,10 +6,13 @@ Sends the top 10 oldest pages to Slack.
 from notion_client import Client
 from notion_client.errors import APIResponseError
 import os
+import random
+import threading
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional, Set, Tuple
 
 # ======================================================
 # CONFIGURATION
@@ -26,39 +29,89 @@ if not ROOT_PAGE_ID:
 
 notion = Client(auth=NOTION_TOKEN)
 ONE_YEAR_AGO = datetime.now(timezone.utc) - timedelta(days=365)
+REQUESTS_PER_SECOND = float(os.getenv("NOTION_RPS", "2.7"))  # Just under Notion's 3 req/s average limit
+if REQUESTS_PER_SECOND <= 0:
+    raise ValueError("NOTION_RPS environment variable must be positive")
+SCAN_WORKERS = 5  # Pages whose metadata is fetched concurrently
+
+# Block types that are scanned as pages rather than as nested content
+PAGE_BLOCK_TYPES = frozenset({"child_page", "child_database"})
 
 # ======================================================
 # API REQUEST HANDLER
 # ======================================================
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+    Lets short bursts through and only sleeps once the request budget is spent.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens: float = 1) -> None:
+        """
+        Take tokens from the bucket, sleeping until enough have accumulated.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def refill(self) -> None:
+        """
+        Restart from one second's worth of tokens, e.g. after a Retry-After wait.
+        """
+        with self.lock:
+            self.tokens = min(self.capacity, self.rate)
+            self.updated = time.monotonic()
+
+# At least one whole token, or a bucket below 1 req/s could never serve a request
+RATE_LIMITER = TokenBucket(rate=REQUESTS_PER_SECOND, capacity=max(1.0, REQUESTS_PER_SECOND))
+
+# Overlaps the round trips of sibling pages; RATE_LIMITER still caps the request rate
+SCAN_EXECUTOR = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+
 def safe_request(func, *args, **kwargs):
     """
     Wrapper for Notion API requests with retry logic and rate limiting.
     Handles 429 rate limits and 5xx server errors automatically.
     """
     max_retries = 8
-    base_delay = 0.3
     backoff_multiplier = 2
     max_backoff = 30
 
     for attempt in range(max_retries):
         try:
-            # Small delay to avoid hitting rate limits
-            time.sleep(base_delay)
+            # Wait only if the request budget is spent
+            RATE_LIMITER.consume()
             return func(*args, **kwargs)
         except APIResponseError as e:
             status = e.status
 
             # Handle rate limiting
             if status == 429:
-                retry_after = int(getattr(e, "headers", {}).get("Retry-After", 1))
-                print(f"Rate limit hit (429). Waiting {retry_after}s before retry...")
+                # Jitter keeps scan workers limited together from retrying in lockstep
+                retry_after = int(getattr(e, "headers", {}).get("Retry-After", 1)) + random.random()
+                print(f"Rate limit hit (429). Waiting {retry_after:.1f}s before retry...")
                 time.sleep(retry_after)
+                RATE_LIMITER.refill()
                 continue
 
             # Handle server errors with exponential backoff
             if 500 <= status <= 599:
-                backoff_time = min(backoff_multiplier ** attempt, max_backoff)
-                print(f"Server error ({status}). Retrying in {backoff_time}s... (attempt {attempt + 1}/{max_retries})")
+                backoff_time = min(backoff_multiplier ** attempt, max_backoff) + random.random()
+                print(f"Server error ({status}). Retrying in {backoff_time:.1f}s... (attempt {attempt + 1}/{max_retries})")
                 time.sleep(backoff_time)
                 continue
 
@@ -80,6 +133,13 @@ def get_page_info(page_id: str) -> Dict[str, any]:
     Retrieve page metadata including title and last edited time.
     """
     page = safe_request(notion.pages.retrieve, page_id=page_id)
+    return build_page_info(page)
+
+def build_page_info(page: Dict) -> Dict[str, any]:
+    """
+    Build page metadata from a page object already returned by the API.
+    """
+    page_id = page["id"]
 
     # Extract title from properties
     title = "Untitled"
@@ -118,8 +178,6 @@ def get_block_children(block_id: str) -> List[Dict]:
         
         if not cursor:
             break
-        
-        time.sleep(0.1)  # Small delay between pagination requests
 
     return blocks
 
@@ -134,82 +192,121 @@ def get_database_pages(database_id: str) -> List[Dict]:
         response = safe_request(
             notion.databases.query,
             database_id=database_id,
-            start_cursor=cursor
+            start_cursor=cursor,
+            page_size=100,
+            # Only the title is read from rows; skip all other property values
+            filter_properties=["title"]
         )
         pages.extend(response.get("results", []))
         cursor = response.get("next_cursor")
         
         if not cursor:
             break
-        
-        time.sleep(0.1)  # Small delay between pagination requests
 
     return pages
 
-def is_empty_page(page_id: str) -> bool:
+def get_database_page(db_page: Dict) -> Optional[Tuple[Dict, List[Dict]]]:
     """
-    Check if a page has any content blocks.
+    Retrieve a database page's child blocks and pair them with its metadata.
+    Returns None for empty pages, which are not reported.
     """
-    try:
-        children = get_block_children(page_id)
-        return len(children) == 0
-    except Exception as e:
-        print(f"Error checking if page {page_id} is empty: {e}")
-        return False
+    # One listing both detects empty pages and seeds the scan
+    page_children = get_block_children(db_page["id"])
+    if not page_children:
+        return None
+    # The query result already carries the title and edit time
+    return build_page_info(db_page), page_children
 
 # ======================================================
 # RECURSIVE PAGE SCANNER
 # ======================================================
-def scan_all_pages(block_id: str) -> List[Dict]:
+def scan_all_pages(root_id: str) -> List[Dict]:
     """
-    Recursively scan all pages and databases starting from a root block.
+    Scan all pages and databases starting from a root block.
+    Walks the tree with an explicit stack instead of recursion, so deeply
+    nested toggles and columns cannot hit Python's recursion limit.
     Returns a list of page information dictionaries.
     """
     pages = []
-    children = get_block_children(block_id)
+    # IDs already queued for scanning, so shared subtrees are fetched once
+    visited: Set[str] = {root_id}
+    # (block_id, already fetched children or None)
+    stack = [(root_id, None)]
 
-    for block in children:
-        block_type = block["type"]
-        block_id = block["id"]
+    while stack:
+        block_id, children = stack.pop()
 
-        # Handle child pages
-        if block_type == "child_page":
+        if children is None:
             try:
-                page_info = get_page_info(block_id)
-                pages.append(page_info)
-                # Recursively scan child pages
-                pages.extend(scan_all_pages(block_id))
+                children = get_block_children(block_id)
             except Exception as e:
-                print(f"Skipping child_page {block_id}: {e}")
+                if block_id == root_id:
+                    raise
+                print(f"Skipping block {block_id}: {e}")
+                continue
+
+        # (kind, block_id, pending lookup or None) in document order, so the
+        # lookups of all siblings run concurrently but results keep their order
+        entries = []
+        for block in children:
+            block_type = block["type"]
+            child_id = block["id"]
+
+            if child_id in visited:
+                continue
+
+            # Handle child pages
+            if block_type == "child_page":
+                visited.add(child_id)
+                entries.append(("child_page", child_id, SCAN_EXECUTOR.submit(get_page_info, child_id)))
+
+            # Handle child databases
+            elif block_type == "child_database":
+                try:
+                    db_pages = get_database_pages(child_id)
+                except Exception as e:
+                    print(f"Skipping child_database {child_id}: {e}")
+                    db_pages = []
 
-        # Handle child databases
-        elif block_type == "child_database":
-            try:
-                db_pages = get_database_pages(block_id)
                 for db_page in db_pages:
                     page_id = db_page["id"]
 
-                    # Skip empty database pages
-                    if is_empty_page(page_id):
-                        print(f"Skipping empty database page: {page_id}")
+                    if page_id in visited:
                         continue
 
-                    try:
-                        page_info = get_page_info(page_id)
-                        pages.append(page_info)
-                        # Recursively scan database pages
-                        pages.extend(scan_all_pages(page_id))
-                    except Exception as e:
-                        print(f"Skipping database page {page_id}: {e}")
-            except Exception as e:
-                print(f"Skipping child_database {block_id}: {e}")
+                    visited.add(page_id)
+                    entries.append(("database page", page_id, SCAN_EXECUTOR.submit(get_database_page, db_page)))
+
+            # Handle deeply nested blocks (e.g., toggle lists, columns)
+            if block.get("has_children") and block_type not in PAGE_BLOCK_TYPES:
+                visited.add(child_id)
+                entries.append(("block", child_id, None))
+
+        subtrees = []
+        for kind, entry_id, lookup in entries:
+            if lookup is None:
+                subtrees.append((entry_id, None))
+                continue
 
-        # Handle deeply nested blocks (e.g., toggle lists, columns)
-        if block.get("has_children") and block_type not in ("child_page", "child_database"):
             try:
-                pages.extend(scan_all_pages(block_id))
+                result = lookup.result()
             except Exception as e:
-                print(f"Skipping nested block {block_id}: {e}")
+                print(f"Skipping {kind} {entry_id}: {e}")
+                continue
+
+            if kind == "child_page":
+                pages.append(result)
+                # Scan the child page's content next
+                subtrees.append((entry_id, None))
+            elif result is None:
+                print(f"Skipping empty database page: {entry_id}")
+            else:
+                page_info, page_children = result
+                pages.append(page_info)
+                subtrees.append((entry_id, page_children))
+
+        # Reversed so subtrees are scanned in document order
+        stack.extend(reversed(subtrees))
 
     return pages
 